@@ -1,10 +1,23 @@
 import streamlit as st
-import anthropic
+import asyncio
+import threading
+from collections import deque
 import zipfile
 import io
+import json
+import re
+import time
 from datetime import datetime
 import os
 
+import cache
+
+# python-docx is optional; without it only .txt uploads can be read
+try:
+    import docx
+except ImportError:
+    docx = None
+
 # Page config
 st.set_page_config(
     page_title="Marvel Snap Blog Translator",
@@ -28,37 +41,215 @@ LANGUAGES = {
     'rus': 'Russian'
 }
 
+# Matches a language code in a filename; longest codes first so 'spa-M9' wins
+# over 'spa', and codes must stand alone so 'thanks' or 'digital' don't match
+LANG_RE = re.compile(
+    r'(?<![A-Za-z])(?:'
+    + '|'.join(re.escape(code) for code in sorted(LANGUAGES, key=len, reverse=True))
+    + r')(?![A-Za-z0-9])'
+)
+
+# Claude model, overridable via the CLAUDE_MODEL secret or environment variable
+DEFAULT_MODEL = "claude-haiku-4-5"
+
+# Output token limit per request, overridable via CLAUDE_MAX_TOKENS. The
+# default is claude-haiku-4-5's output limit; models with smaller limits are
+# capped by prefix below, and simply get fewer languages per request
+DEFAULT_MAX_TOKENS = 64000
+MODEL_MAX_TOKENS = {
+    'claude-opus-4-0': 32000,
+    'claude-opus-4-1': 32000,
+    'claude-opus-4-2025': 32000,
+    'claude-3-5-': 8192,
+    'claude-3-opus': 4096,
+    'claude-3-sonnet': 4096,
+    'claude-3-haiku': 4096
+}
+
+# Output tokens per English input token, by language; scripts that tokenize
+# longer than English get more headroom
+TOKEN_MULTIPLIERS = {
+    'tha': 2.0,
+    'zho-CN': 1.8,
+    'zho-TW': 1.8,
+    'jpn': 1.8,
+    'kor': 1.8,
+    'rus': 1.6
+}
+DEFAULT_TOKEN_MULTIPLIER = 1.4
+
+# Extra output for JSON-escaping the HTML (\" and \n) inside the response
+JSON_ESCAPE_OVERHEAD = 1.25
+
+# Whitespace between two tags; trimmed before prompting to cut input tokens
+INTER_TAG_WHITESPACE_RE = re.compile(r'>\s+<')
+
+# Max number of Claude requests in flight at once (keeps us under tier rate limits)
+MAX_CONCURRENT_REQUESTS = 6
+
+# API calls admitted per minute across all runs and sessions (Anthropic tier 1 limit)
+REQUESTS_PER_MINUTE = 40
+
+# Upper bound on languages per Claude request; requests are otherwise packed
+# until their output budget would exceed the model's limit
+LANGUAGES_PER_REQUEST = 6
+
+# Live output preview: refresh at most this often, showing only the last few characters
+STREAM_REFRESH_SECONDS = 0.2
+STREAM_PREVIEW_CHARS = 2000
+
+# Fastest deflate level; HTML still compresses well and the ZIP is only a download bundle
+ZIP_COMPRESSLEVEL = 1
+
+def get_setting(name, default=None):
+    """Read a setting from Streamlit secrets, falling back to the environment"""
+    try:
+        value = st.secrets.get(name)
+    except FileNotFoundError:
+        # No secrets.toml at all, e.g. when configured only through env vars
+        value = None
+    return value if value is not None else os.getenv(name, default)
+
+def get_model():
+    """Return the configured Claude model"""
+    return get_setting("CLAUDE_MODEL", DEFAULT_MODEL)
+
+def get_max_tokens():
+    """Return the output token limit per request for the configured model"""
+    max_tokens = int(get_setting("CLAUDE_MAX_TOKENS", DEFAULT_MAX_TOKENS))
+    model = get_model()
+    for prefix, limit in MODEL_MAX_TOKENS.items():
+        if model.startswith(prefix):
+            return min(max_tokens, limit)
+    return max_tokens
+
+class RateLimiter:
+    """Sliding-window rate limiter, safe to share between sessions' threads and event loops"""
+    
+    def __init__(self, max_rate, time_period=60):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._lock = threading.Lock()
+        self._admitted = deque()
+    
+    async def __aenter__(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._admitted and now - self._admitted[0] >= self.time_period:
+                    self._admitted.popleft()
+                if len(self._admitted) < self.max_rate:
+                    self._admitted.append(now)
+                    return self
+                wait = self.time_period - (now - self._admitted[0])
+            await asyncio.sleep(wait)
+    
+    async def __aexit__(self, *exc_info):
+        return False
+
+@st.cache_resource
+def get_rate_limiter():
+    """Return the API rate limiter shared by every run and session"""
+    # Streamlit re-executes the script on each rerun and each session runs on its
+    # own thread and event loop, so the limiter lives in cache_resource and
+    # doesn't depend on any one loop
+    return RateLimiter(REQUESTS_PER_MINUTE, 60)
+
 def init_anthropic():
     """Initialize Anthropic client with API key"""
-    api_key = st.secrets.get("ANTHROPIC_API_KEY", os.getenv("ANTHROPIC_API_KEY"))
+    # Imported here so the SDK (httpx, pydantic) isn't loaded before first use
+    import anthropic
+    
+    api_key = get_setting("ANTHROPIC_API_KEY")
     if not api_key:
         st.error("⚠️ Please set up your Anthropic API key in Streamlit secrets")
         st.info("Go to Settings → Secrets and add: ANTHROPIC_API_KEY = 'your-key-here'")
         return None
-    return anthropic.Anthropic(api_key=api_key)
+    return anthropic.AsyncAnthropic(
+        api_key=api_key,
+        default_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
+    )
+
+# Bounded so old uploads don't stay in server memory; 32 covers a couple of full sets of 12 files
+@st.cache_data(show_spinner=False, max_entries=32)
+def decode_file(name, data):
+    """Decode uploaded file bytes to text, cached across reruns"""
+    if name.endswith('.docx'):
+        doc = docx.Document(io.BytesIO(data))
+        return '\n'.join(para.text for para in doc.paragraphs if para.text)
+    return data.decode('utf-8')
 
 def read_file_content(uploaded_file):
     """Read content from uploaded file"""
+    if uploaded_file.name.endswith('.docx') and docx is None:
+        st.error(f"Error reading {uploaded_file.name}: python-docx is not installed")
+        return None
     try:
-        content = uploaded_file.read()
-        if uploaded_file.name.endswith('.txt'):
-            return content.decode('utf-8')
-        elif uploaded_file.name.endswith('.docx'):
-            # For docx files, we'll need python-docx
-            import docx
-            doc = docx.Document(io.BytesIO(content))
-            return '\n'.join([para.text for para in doc.paragraphs])
-        else:
-            return content.decode('utf-8')
+        return decode_file(uploaded_file.name, uploaded_file.getvalue())
     except Exception as e:
         st.error(f"Error reading {uploaded_file.name}: {str(e)}")
         return None
 
-def translate_blog(client, english_html, translations):
-    """Translate blog into all languages using Claude"""
-    results = {}
-    
-    # Create the prompt
+def map_files(uploaded_files):
+    """Map each detected language code to its uploaded file in a single pass"""
+    file_map = {}
+    for file in uploaded_files or []:
+        m = LANG_RE.search(file.name)
+        if m:
+            file_map[m.group(0)] = file
+    return file_map
+
+def update_file_map():
+    """Rebuild the language → file mapping whenever the uploads change"""
+    st.session_state.file_map = map_files(st.session_state.uploaded_files)
+
+def inputs_key(english_html, translations):
+    """Hash everything a translation run depends on, to spot repeat runs"""
+    return cache.hash_parts(get_model(), english_html, *(part for item in sorted(translations.items()) for part in item))
+
+def parse_translations(text):
+    """Parse the JSON object of {lang_code: html} returned by Claude"""
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end == -1:
+        raise ValueError("no JSON object in response")
+    return json.loads(text[start:end + 1])
+
+def parse_message(message):
+    """Parse a finished Claude message, reporting it if it was cut off at max_tokens"""
+    if message.stop_reason == "max_tokens":
+        raise ValueError(f"response truncated at the max_tokens limit ({message.usage.output_tokens} tokens)")
+    return parse_translations(message.content[0].text)
+
+def minify_english(english_html):
+    """Trim whitespace between tags in the English HTML to cut input tokens"""
+    # Tags, attributes and text are left exactly as written, since the prompt
+    # asks Claude to copy the English formatting; whitespace-sensitive markup
+    # is left alone entirely
+    if '<pre' in english_html or '<textarea' in english_html:
+        return english_html
+    # Line breaks (and so blank lines between WordPress blocks) are kept; only
+    # the indentation and runs of spaces around them go
+    return INTER_TAG_WHITESPACE_RE.sub(
+        lambda m: '>' + ('\n' * m.group(0).count('\n') or ' ') + '<',
+        english_html
+    )
+
+async def count_english_tokens(client, english_html):
+    """Count the input tokens of the (minified) English HTML, or None if counting fails"""
+    try:
+        # Token counting counts against the same per-minute request limit
+        async with get_rate_limiter():
+            response = await client.messages.count_tokens(
+                model=get_model(),
+                messages=[{"role": "user", "content": english_html}]
+            )
+        return response.input_tokens
+    except Exception:
+        return None
+
+def build_system_prompt(english_html, translations):
+    """Build the shared system prompt from the (minified) English HTML, marked cacheable across requests"""
+    # Create the shared prompt (static content only, so it can be cached)
     prompt = f"""You're an expert WordPress user and blog translator for MARVEL SNAP. 
 I have the English HTML blog and translations for 12 languages.
 
@@ -74,45 +265,233 @@ English HTML:
 Translations provided:
 """
     
-    # Add all translations to the prompt
-    for lang_code, content in translations.items():
-        if content:
-            prompt += f"\n\n{LANGUAGES.get(lang_code, lang_code)}:\n{content}"
+    # Add all translations to the prompt in one join rather than re-copying it per language
+    prompt += ''.join(
+        f"\n\n{LANGUAGES.get(lang_code, lang_code)}:\n{content}"
+        for lang_code, content in translations.items() if content
+    )
     
-    # Process each language
+    # Mark the shared prefix as cacheable so every language call after the first reuses it
+    return [{
+        "type": "text",
+        "text": prompt,
+        "cache_control": {"type": "ephemeral"}
+    }]
+
+def pending_languages(translations, done=()):
+    """List the (lang_code, lang_name) pairs we have translations for, skipping done"""
+    pending = []
     for lang_code, lang_name in LANGUAGES.items():
         if lang_code not in translations or not translations[lang_code]:
             st.warning(f"⚠️ No translation file for {lang_name}")
             continue
-            
+        if lang_code not in done:
+            pending.append((lang_code, lang_name))
+    return pending
+
+def language_budget(lang_code, english_tokens):
+    """Estimate the output tokens one language needs from the English token count"""
+    multiplier = TOKEN_MULTIPLIERS.get(lang_code, DEFAULT_TOKEN_MULTIPLIER)
+    return int(english_tokens * multiplier * JSON_ESCAPE_OVERHEAD) + 256
+
+def group_languages(pending, english_tokens):
+    """Pack languages into per-request groups whose output budget fits the model's limit"""
+    # Several languages per request, so the shared input is processed fewer times;
+    # without a token count, fall back to LANGUAGES_PER_REQUEST per group
+    max_tokens = get_max_tokens()
+    groups = []
+    group, budget = [], 0
+    for lang_code, lang_name in pending:
+        cost = language_budget(lang_code, english_tokens) if english_tokens is not None else 0
+        if group and (budget + cost > max_tokens or len(group) == LANGUAGES_PER_REQUEST):
+            groups.append(group)
+            group, budget = [], 0
+        group.append((lang_code, lang_name))
+        budget += cost
+    if group:
+        groups.append(group)
+    return groups
+
+def token_budget(group, english_tokens):
+    """Size max_tokens for a group from the English token count, capped at the model's limit"""
+    max_tokens = get_max_tokens()
+    if english_tokens is None:
+        return max_tokens
+    return min(max_tokens, sum(language_budget(lang_code, english_tokens) for lang_code, _ in group))
+
+def build_request_params(system, group, english_tokens):
+    """Build the Messages API parameters for one group of languages"""
+    lang_list = ', '.join(f"{lang_name} ({lang_code})" for lang_code, lang_name in group)
+    lang_keys = ', '.join(f'"{lang_code}"' for lang_code, _ in group)
+    return {
+        "model": get_model(),
+        "max_tokens": token_budget(group, english_tokens),
+        "system": system,
+        "messages": [{
+            "role": "user",
+            "content": f"Now create the {lang_list} versions. Return ONLY a JSON object mapping each language code ({lang_keys}) to its complete HTML code, no explanations."
+        }]
+    }
+
+def collect_results(group, response, results):
+    """Store one group's parsed response in results and report each language"""
+    for lang_code, lang_name in group:
+        if isinstance(response, Exception):
+            st.error(f"❌ Error translating {lang_name}: {str(response)}")
+        elif not response.get(lang_code):
+            st.error(f"❌ Error translating {lang_name}: missing from response")
+        else:
+            results[lang_code] = response[lang_code]
+            st.success(f"✅ {lang_name} complete")
+
+def load_cached(english_html, translations):
+    """Return each language's disk cache key and the translations already cached"""
+    # Reuse earlier output for languages whose inputs haven't changed
+    cache_keys = {
+        lang_code: cache.make_key(get_model(), english_html, content, lang_code)
+        for lang_code, content in translations.items() if content
+    }
+    results = {}
+    for lang_code, key in cache_keys.items():
+        html = cache.get(key)
+        if html:
+            results[lang_code] = html
+            st.success(f"✅ {LANGUAGES[lang_code]} complete (cached)")
+    return cache_keys, results
+
+def store_cached(cache_keys, group, results):
+    """Write a group's successful translations to the disk cache"""
+    for lang_code, _ in group:
+        if lang_code in results:
+            cache.set(cache_keys[lang_code], results[lang_code])
+
+async def translate_blog(client, english_html, translations, progress_bar):
+    """Translate blog into all languages concurrently using Claude, updating progress_bar"""
+    cache_keys, results = load_cached(english_html, translations)
+    
+    english_min = minify_english(english_html)
+    system = build_system_prompt(english_min, translations)
+    pending = pending_languages(translations, done=results)
+    english_tokens = await count_english_tokens(client, english_min) if pending else None
+    groups = group_languages(pending, english_tokens)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    limiter = get_rate_limiter()
+
+    # Set once the first request has started generating, i.e. its prefill (and
+    # so the prompt cache write) is done
+    cache_warm = asyncio.Event()
+
+    async def translate_group(group, placeholder, first):
+        # Stream tokens into the placeholder so output shows up as it's generated;
+        # errors are returned rather than raised so they're reported per language
+        text = ""
+        last_refresh = 0.0
         try:
-            with st.spinner(f"Translating to {lang_name}..."):
-                response = client.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=8000,
-                    messages=[{
-                        "role": "user",
-                        "content": f"{prompt}\n\nNow create the {lang_name} ({lang_code}) version. Return ONLY the HTML code, no explanations."
-                    }]
-                )
-                results[lang_code] = response.content[0].text
-                st.success(f"✅ {lang_name} complete")
+            if not first:
+                await cache_warm.wait()
+            async with semaphore, limiter:
+                async with client.messages.stream(**build_request_params(system, group, english_tokens)) as stream:
+                    async for chunk in stream.text_stream:
+                        cache_warm.set()
+                        text += chunk
+                        # Throttled, tail-only updates keep websocket traffic small
+                        now = time.monotonic()
+                        if now - last_refresh >= STREAM_REFRESH_SECONDS:
+                            last_refresh = now
+                            placeholder.code(text[-STREAM_PREVIEW_CHARS:], language="json")
+                    message = await stream.get_final_message()
+            return group, parse_message(message)
         except Exception as e:
-            st.error(f"❌ Error translating {lang_name}: {str(e)}")
+            return group, e
+        finally:
+            # Never leave the other requests waiting if the first one fails
+            if first:
+                cache_warm.set()
+            placeholder.empty()
+    
+    # One live output area per request
+    jobs = [(group, st.empty()) for group in groups]
+    
+    total = len(cache_keys)
+    processed = len(results)
+    
+    def update_progress():
+        # The bar tracks languages processed; the label says how many actually succeeded
+        failed = processed - len(results)
+        label = f"{len(results)}/{total} languages translated" + (f", {failed} failed" if failed else "")
+        progress_bar.progress(processed / max(total, 1), text=label)
+    
+    update_progress()
+    
+    # The first request writes the shared prefix to the prompt cache and the
+    # rest start as soon as it begins streaming, so they read from it; the
+    # semaphore caps concurrency and the limiter paces requests to stay under
+    # the per-minute rate limit
+    tasks = [translate_group(group, placeholder, idx == 0) for idx, (group, placeholder) in enumerate(jobs)]
+    for next_done in asyncio.as_completed(tasks):
+        group, response = await next_done
+        collect_results(group, response, results)
+        store_cached(cache_keys, group, results)
+        
+        processed += len(group)
+        update_progress()
     
     return results
 
-def create_zip_file(translations):
-    """Create a ZIP file with all translations"""
+async def submit_batch(client, english_html, translations, done=()):
+    """Submit all languages not in done to the Message Batches API and return the batch id, or None if there's nothing to submit"""
+    pending = pending_languages(translations, done=done)
+    if not pending:
+        return None
+    
+    english_min = minify_english(english_html)
+    system = build_system_prompt(english_min, translations)
+    english_tokens = await count_english_tokens(client, english_min)
+    groups = group_languages(pending, english_tokens)
+    requests = [
+        {
+            # Language codes never contain '_', so the group can be recovered from the id
+            "custom_id": '_'.join(lang_code for lang_code, _ in group),
+            "params": build_request_params(system, group, english_tokens)
+        }
+        for group in groups
+    ]
+    batch = await client.messages.batches.create(requests=requests)
+    return batch.id
+
+async def fetch_batch_results(client, batch_id, cache_keys):
+    """Return translations from a finished batch, or None while it is still processing"""
+    batch = await client.messages.batches.retrieve(batch_id)
+    if batch.processing_status != "ended":
+        return None
+    
+    results = {}
+    async for entry in await client.messages.batches.results(batch_id):
+        group = [(lang_code, LANGUAGES[lang_code]) for lang_code in entry.custom_id.split('_')]
+        if entry.result.type == "succeeded":
+            try:
+                response = parse_message(entry.result.message)
+            except ValueError as e:
+                response = e
+        else:
+            response = RuntimeError(f"batch request {entry.result.type}")
+        collect_results(group, response, results)
+        store_cached(cache_keys, group, results)
+    
+    return results
+
+# Bounded so old ZIPs don't stay in server memory
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_zip(translations):
+    """Create a ZIP file from (lang_code, html) pairs and return its bytes, cached across reruns"""
     zip_buffer = io.BytesIO()
     
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for lang_code, content in translations.items():
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL) as zip_file:
+        for lang_code, content in translations:
             filename = f"marvel_snap_blog_{lang_code}.html"
             zip_file.writestr(filename, content)
     
-    zip_buffer.seek(0)
-    return zip_buffer
+    return zip_buffer.getvalue()
 
 # Main UI
 st.title("🎮 Marvel Snap Blog Translator")
@@ -132,6 +511,12 @@ with st.expander("📋 Instructions", expanded=True):
 # Initialize session state
 if 'translations' not in st.session_state:
     st.session_state.translations = {}
+if 'batch_id' not in st.session_state:
+    st.session_state.batch_id = None
+if 'file_map' not in st.session_state:
+    st.session_state.file_map = {}
+if 'last_key' not in st.session_state:
+    st.session_state.last_key = None
 
 # Input section
 col1, col2 = st.columns([1, 1])
@@ -150,24 +535,25 @@ with col2:
         "Upload translation files",
         accept_multiple_files=True,
         type=['txt', 'docx'],
-        help="Select all 12 translation files at once"
+        help="Select all 12 translation files at once",
+        key="uploaded_files",
+        on_change=update_file_map
     )
     
     if uploaded_files:
         st.info(f"📎 {len(uploaded_files)} files uploaded")
         
-        # Show which languages are uploaded
-        uploaded_langs = []
-        for file in uploaded_files:
-            for lang_code in LANGUAGES.keys():
-                if lang_code in file.name:
-                    uploaded_langs.append(lang_code)
-                    break
-        
-        missing_langs = set(LANGUAGES.keys()) - set(uploaded_langs)
+        # Show which languages are missing
+        missing_langs = [lang_code for lang_code in LANGUAGES if lang_code not in st.session_state.file_map]
         if missing_langs:
             st.warning(f"⚠️ Missing: {', '.join(missing_langs)}")
 
+# Batch mode toggle
+batch_mode = st.checkbox(
+    "Batch mode (cheaper, async)",
+    help="Submit via the Message Batches API at half the cost. Results can take a while; check back to collect them."
+)
+
 # Translate button
 if st.button("🚀 Translate All Languages", type="primary", use_container_width=True):
     if not english_html:
@@ -175,35 +561,89 @@ if st.button("🚀 Translate All Languages", type="primary", use_container_width
     elif not uploaded_files:
         st.error("Please upload translation files!")
     else:
-        # Initialize API client
-        client = init_anthropic()
-        if not client:
-            st.stop()
-        
         # Read all translation files
         translations = {}
-        for file in uploaded_files:
-            # Identify language from filename
-            lang_code = None
-            for code in LANGUAGES.keys():
-                if code in file.name:
-                    lang_code = code
-                    break
-            
-            if lang_code:
-                content = read_file_content(file)
-                if content:
-                    translations[lang_code] = content
-        
-        # Perform translations
-        st.markdown("### 🔄 Processing Translations")
-        progress_bar = st.progress(0)
+        for lang_code, file in st.session_state.file_map.items():
+            content = read_file_content(file)
+            if content:
+                translations[lang_code] = content
         
-        results = translate_blog(client, english_html, translations)
-        st.session_state.translations = results
+        # Skip the whole run if these exact inputs were already translated this session
+        key = inputs_key(english_html, translations)
+        if key == st.session_state.last_key and st.session_state.translations:
+            st.info("✅ Already translated these inputs, see downloads below")
+        else:
+            # Initialize API client
+            client = init_anthropic()
+            if not client:
+                st.stop()
+            
+            if batch_mode:
+                # Languages already on disk don't need to go in the batch
+                cache_keys, cached = load_cached(english_html, translations)
+                try:
+                    batch_id = asyncio.run(submit_batch(client, english_html, translations, done=cached))
+                except Exception as e:
+                    st.error(f"❌ Error submitting batch: {str(e)}")
+                else:
+                    if batch_id:
+                        # Results are collected when the user checks the batch status
+                        st.session_state.batch_id = batch_id
+                        st.session_state.batch_key = key
+                        st.session_state.batch_cache_keys = cache_keys
+                        st.session_state.batch_cached = cached
+                    else:
+                        # Everything was cached, so this run is complete
+                        st.session_state.translations = cached
+                        st.session_state.last_key = key
+                        st.success(f"✅ Completed {len(cached)} translations!")
+            else:
+                # Perform translations
+                st.markdown("### 🔄 Processing Translations")
+                progress_bar = st.progress(0)
+                
+                results = asyncio.run(translate_blog(client, english_html, translations, progress_bar))
+                st.session_state.translations = results
+                # Only remember complete runs, so failed languages can be retried
+                st.session_state.last_key = key if len(results) == len(translations) else None
+                
+                st.success(f"✅ Completed {len(results)} translations!")
+
+# Pending batch
+if st.session_state.batch_id:
+    st.info(f"⏳ Batch {st.session_state.batch_id} submitted, check its status to collect the results")
+    check_col, discard_col = st.columns(2)
+    with check_col:
+        check_batch = st.button("🔄 Check Batch Status", use_container_width=True)
+    with discard_col:
+        discard_batch = st.button("🗑️ Discard Batch", use_container_width=True)
+    
+    if discard_batch:
+        st.session_state.batch_id = None
+        st.rerun()
+    
+    # Only poll on request, not on every rerun
+    if check_batch:
+        client = init_anthropic()
+        if not client:
+            st.stop()
         
-        progress_bar.progress(100)
-        st.success(f"✅ Completed {len(results)} translations!")
+        try:
+            results = asyncio.run(fetch_batch_results(
+                client, st.session_state.batch_id, st.session_state.batch_cache_keys
+            ))
+        except Exception as e:
+            st.error(f"❌ Error checking batch: {str(e)}")
+        else:
+            if results is None:
+                st.info("⏳ Still processing, check again later")
+            else:
+                st.session_state.translations = {**st.session_state.batch_cached, **results}
+                # Only remember complete runs, so failed languages can be retried
+                complete = len(st.session_state.translations) == len(st.session_state.batch_cache_keys)
+                st.session_state.last_key = st.session_state.batch_key if complete else None
+                st.session_state.batch_id = None
+                st.success(f"✅ Completed {len(st.session_state.translations)} translations!")
 
 # Results section
 if st.session_state.translations:
@@ -213,7 +653,7 @@ if st.session_state.translations:
     # Download all as ZIP
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        zip_file = create_zip_file(st.session_state.translations)
+        zip_file = build_zip(tuple(st.session_state.translations.items()))
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         st.download_button(
             label="⬇️ Download All as ZIP",
@@ -0,0 +1,26 @@
+"""On-disk cache of translated HTML, so unchanged inputs skip the API call"""
+import hashlib
+
+import diskcache
+
+_cache = diskcache.Cache("./.translation_cache")
+
+def hash_parts(*parts):
+    """Hash a sequence of strings, NUL-separated so part boundaries can't be shifted"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def make_key(model, english_html, content, lang_code):
+    """Key one language's output on the model, the English HTML and that language's translation only"""
+    return hash_parts(model, english_html, content, lang_code)
+
+def get(key):
+    """Return the cached HTML for key, or None"""
+    return _cache.get(key)
+
+def set(key, html):
+    """Store the translated HTML under key"""
+    _cache.set(key, html)